@@ -1,119 +1,786 @@
 import logging
-import secrets
 from pathlib import Path
 from subprocess import Popen, PIPE
 
 from config import appname, config
+import plug
 
 plugin_name = Path(__file__).parent.name
 logger = logging.getLogger(f"{appname}.{plugin_name}")
 
 logger.debug("edmcoverlay CE: lib loaded")
 
+import collections
+import ctypes
 import errno
+import itertools
 import json
-import re
+import os
+import selectors
+import signal
 import socket
+import sys
 import threading
 import time
-from functools import wraps
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 IS_PRETENDING_TO_BE_EDMCOVERLAY = True
 
+# how many times to try (re)connecting before dropping a batch of messages,
+# and how long to wait between tries (doubling each time, up to the max)
+RECONNECT_ATTEMPTS = 4
+RECONNECT_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5
+# seconds of idleness before the OS starts probing a quiet connection
+KEEPALIVE_IDLE = 60
+# how long to wait for the overlay process to come up before giving up on a send
+STARTUP_TIMEOUT = 5
+# how many times in a row the overlay can fail to start before we stop restarting
+# it ourselves, and leave it until something calls start_overlay()
+START_ATTEMPTS = 3
+# how often to throw away what we remember about messages that have since expired
+PRUNE_INTERVAL = 60
+# how many messages (the latest for each id) to hold on to for an overlay that isn't
+# keeping up, before the oldest start getting dropped
+MAX_UNSENT = 10000
+
+GEOMETRY_DEFAULTS = {"xpos": 0, "ypos": 0, "width": 1920, "height": 1080}
+
+READY_MESSAGE = b"server: ready to accept connections"
+
+# the overlay also listens on this abstract unix socket (see unix_socket_name in main.rs)
+if sys.platform.startswith("linux"):
+    UNIX_SOCKET_NAME = f"\0edmcoverlay-{os.getuid()}"
+else:
+    UNIX_SOCKET_NAME = None
+
+if sys.platform.startswith("linux"):
+    PR_SET_PDEATHSIG = 1
+    _libc = ctypes.CDLL(None, use_errno=True)
+
+    def _die_with_parent(parent=os.getpid()):
+        # runs in the overlay process between fork and exec. being in its own
+        # session, nothing else would stop it outliving an EDMC that died without
+        # running plugin_stop (e.g. SIGKILL) and holding on to the port forever.
+        # strictly, this fires when the thread that started it exits, but that's
+        # EDMC's UI thread or the reactor thread, and both last as long as EDMC
+        _libc.prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+        if os.getppid() != parent:
+            # too late, it's already gone
+            os._exit(1)
+else:
+    _die_with_parent = None
+
 overlay_process: Popen = None
+# set once the overlay process has told us it's listening, or once it's
+# exited or run out of time without doing so
+overlay_ready = threading.Event()
+overlay_failed = threading.Event()
+_start_failures = 0
+# held while starting or stopping the overlay, which happens on both EDMC's
+# UI thread and the reactor thread
+_overlay_lock = threading.RLock()
+
+
+if orjson is not None:
+    def _encode(msg) -> bytes:
+        return orjson.dumps(msg)
+else:
+    def _encode(msg) -> bytes:
+        # skip the cosmetic whitespace
+        return json.dumps(msg, separators=(",", ":")).encode("utf-8")
+
+
+def _frame(messages) -> bytes:
+    # the server reads newline-delimited JSON. the whole batch is built up
+    # front so it's written as one piece: never write a message (or part of
+    # one) separately, or the writes get split into tiny packets again.
+    return b"\n".join([*messages, b""])
+
+
+def _msgid(msg):
+    return msg["id"] if isinstance(msg, dict) and "id" in msg else None
 
 
+@lru_cache(maxsize=1)
+def overlay_geometry():
+    """Get the overlay's (xpos, ypos, width, height) from the config.
+
+    This is cached, so call overlay_geometry.cache_clear() after changing them.
+    """
+    geometry = []
+    for name, default in GEOMETRY_DEFAULTS.items():
+        try:
+            value = int(config.get(f"edmcoverlay2_{name}") or default)
+            if value < 0:
+                raise ValueError(value)
+        except (TypeError, ValueError):
+            logger.warning("edmcoverlay CE: bad config value for %s, using %d instead", name, default)
+            value = default
+        geometry.append(value)
+    return tuple(geometry)
+
+
+@lru_cache(maxsize=1)
 def find_overlay_binary() -> Path:
     our_directory = Path(__file__).resolve().parent
     overlay_binary = our_directory / "target" / "release" / "edmcoverlay"
     if not overlay_binary.exists():
-        plug.show_error("edmcoverlay unable to find overlay binary")
         raise RuntimeError("edmcoverlay: unable to find overlay binary")
     return overlay_binary
 
 
 def start_overlay():
+    global _start_failures
+    with _overlay_lock:
+        _start_failures = 0
+        return _start_overlay()
+
+
+def _start_overlay():
     global overlay_process
-    if not overlay_process:
+    with _overlay_lock:
+        if overlay_process:
+            logger.warning("edmcoverlay CE: not starting overlay, already running")
+            return
         logger.info("edmcoverlay CE: starting overlay")
-        xpos = int(config.get("edmcoverlay2_xpos") or 0)
-        ypos = int(config.get("edmcoverlay2_ypos") or 0)
-        width = int(config.get("edmcoverlay2_width") or 1920)
-        height = int(config.get("edmcoverlay2_height") or 1080)
-        overlay_process = Popen([find_overlay_binary(), str(xpos), str(ypos), str(width), str(height)], stdout=PIPE)
-        for _ in range(5):
-            line = overlay_process.stdout.readline()
-            if line.strip() == b"server: ready to accept connections":
-                time.sleep(0.01)
-                break
-            else:
-                logger.warning("edmcoverlay CE: unexpected message from server:", line.decode())
-        else:
-            raise RuntimeError("edmcoverlay CE: server failed to start up")
+        try:
+            overlay_binary = find_overlay_binary()
+        except RuntimeError:
+            # Tk calls are only safe on the UI thread; elsewhere, logging will have to do
+            if threading.current_thread() is threading.main_thread():
+                plug.show_error("edmcoverlay unable to find overlay binary")
+            raise
+        xpos, ypos, width, height = overlay_geometry()
+        overlay_ready.clear()
+        overlay_failed.clear()
+        # in its own session, so that signals aimed at EDMC's terminal (e.g. ^C)
+        # don't kill the overlay before plugin_stop gets to shut it down
+        overlay_process = Popen(
+            [overlay_binary, str(xpos), str(ypos), str(width), str(height)],
+            stdout=PIPE,
+            start_new_session=True,
+            preexec_fn=_die_with_parent,
+        )
+        # don't hold up EDMC's UI while the overlay gets going
+        threading.Thread(
+            target=_wait_for_overlay,
+            args=(overlay_process,),
+            name="edmcoverlay-startup",
+            daemon=True,
+        ).start()
         return True
-    else:
-        logger.warning("edmcoverlay CE: not starting overlay, already running")
+
+
+def _wait_for_overlay(process: Popen):
+    # this thread owns the overlay's stdout from here on
+    fd = process.stdout.fileno()
+    os.set_blocking(fd, False)
+    output = bytearray()
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    ready = False
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            # keep reading until the overlay exits, even once it's ready or we've given
+            # up on it, so it never blocks (or gets EPIPE) writing to a pipe nobody is emptying
+            while True:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                if not selector.select(timeout):
+                    deadline = None
+                    _startup_failed(process, output)
+                    continue
+                chunk = os.read(fd, 4096)
+                if not chunk:
+                    break
+                if ready:
+                    continue
+                output += chunk
+                if READY_MESSAGE in output:
+                    # late or not, it's usable now
+                    ready = True
+                    deadline = None
+                    _startup_succeeded(process)
+                del output[:-4096]
+    finally:
+        process.stdout.close()
+    if deadline is not None:
+        _startup_failed(process, output)
+
+
+def _startup_succeeded(process: Popen):
+    global _start_failures
+    with _overlay_lock:
+        if process is not overlay_process:
+            return
+        _start_failures = 0
+        overlay_failed.clear()
+        overlay_ready.set()
+    # anything waiting to connect can go ahead now
+    _wake_reactor()
+
+
+def _startup_failed(process: Popen, output):
+    global _start_failures
+    # if it's being stopped, this waits until that's finished
+    with _overlay_lock:
+        if process is not overlay_process:
+            return
+        _start_failures += 1
+        overlay_failed.set()
+        logger.error("edmcoverlay CE: server failed to start up, output was: %r", bytes(output))
+    # don't leave anything waiting out the timeout for an overlay that isn't coming
+    _wake_reactor()
 
 
 def stop_overlay():
     global overlay_process
-    if overlay_process:
+    with _overlay_lock:
+        if not overlay_process:
+            logger.warning("edmcoverlay CE: not stopping overlay, not started")
+            return
         logger.info("edmcoverlay CE: stopping overlay")
+        overlay_ready.clear()
         overlay_process.terminate()
-        overlay_process.communicate()
+        # only forget about it once it's gone, so nobody can start another
+        # overlay while this one is still holding on to the port
+        overlay_process.wait()
         overlay_process = None
         return True
-    else:
-        logger.warning("edmcoverlay CE: not stopping overlay, not started")
 
 
 def ensure_overlay():
     global overlay_process
-    if not overlay_process:
-        start_overlay()
-        return True
+    with _overlay_lock:
+        if overlay_process and overlay_process.poll() is not None:
+            logger.warning("edmcoverlay CE: overlay exited with status %d", overlay_process.returncode)
+            overlay_ready.clear()
+            overlay_process = None
+        if not overlay_process:
+            if _start_failures >= START_ATTEMPTS:
+                logger.warning("edmcoverlay CE: overlay failed to start %d times in a row, not restarting it", _start_failures)
+                return False
+            _start_overlay()
+            return True
 
 
-class Overlay:
-    def __init__(self, server="127.0.0.1", port=5010) -> None:
-        # self._token = secrets.token_hex(4)
+class _FlushWaiter:
+    """Handed to the reactor by flush(), to say whether everything before it was written."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.ok = False
+
+
+class _Connection:
+    """A connection to the overlay server, shared by every Overlay using the same address."""
+
+    def __init__(self, server, port) -> None:
         self._server = server
         self._port = port
+        # our own overlay can be reached without going through TCP at all
+        if UNIX_SOCKET_NAME is not None and (server, port) == ("127.0.0.1", 5010):
+            self._unix_address = UNIX_SOCKET_NAME
+        else:
+            self._unix_address = None
         self._conn = None
-        self._connected = False
+        self._conn_process = None
+        self._connecting = False
+        self._events = 0
+        self._backoff = RECONNECT_DELAY
+        self._attempts = 0
+        self._retry_at = 0
+        self._startup_deadline = None
+        # msgid -> (everything else about the message, when it expires, which connection it
+        # went over). every plugin's thread checks this, and the reactor updates it, so hold the lock
+        self._last_sent = {}
+        self._last_sent_lock = threading.Lock()
+        # goes up (with the lock held) each time a connection is lost: the overlay keys
+        # what it draws by connection, so nothing sent over an old one can be repeated
+        self._generation = 0
+        self._next_prune = time.monotonic() + PRUNE_INTERVAL
+        # everything below is only touched by the reactor thread, as is everything to do with the socket.
+        # messages, plus _FlushWaiters to resolve once everything before them is written
+        self._pending = []
+        # messages waiting to be encoded and written, only the latest for each id:
+        # id -> (sequence number, message), oldest first
+        self._unsent = collections.OrderedDict()
+        self._sequence = 0
+        # what's being written, how much of it has gone, the id of each message
+        # in it, and the sequence numbers of the oldest and newest of those
+        self._out = b""
+        self._offset = 0
+        self._out_ids = []
+        self._out_span = (0, 0)
+        # [sequence number of the last message before it, whether anything up to there was dropped, _FlushWaiter]
+        self._waiters = collections.deque()
+        # whether anything has been dropped since the last _FlushWaiter, which should hear about it
+        self._dropped = False
+        # so that falling behind is only logged once each time it happens
+        self._overflowing = False
+
+    def _connect_at(self):
+        """When the reactor should next try connecting, or None if there's no need."""
+        if self._conn is not None or self._oldest_unwritten() is None:
+            return None
+        if self._startup_deadline is not None and not overlay_ready.is_set() and not overlay_failed.is_set():
+            # the startup thread wakes the reactor once the overlay is ready, or isn't going to be
+            return self._startup_deadline
+        return self._retry_at
+
+    def _service(self, now):
+        if self._conn is not None and self._conn_process is not overlay_process:
+            # the overlay was restarted under us, this connection is dead
+            self._disconnect()
+        connect_at = self._connect_at()
+        if connect_at is not None and connect_at <= now:
+            self._connect(now)
+        # only ask to hear about the socket being writable when there's something to write
+        if self._conn is not None:
+            if self._connecting:
+                events = selectors.EVENT_WRITE
+            elif self._out or self._unsent:
+                events = selectors.EVENT_READ | selectors.EVENT_WRITE
+            else:
+                events = selectors.EVENT_READ
+            if events != self._events:
+                _selector.modify(self._conn, events, self)
+                self._events = events
+
+    def _connect(self, now):
+        try:
+            started = ensure_overlay() is not False
+        except (OSError, RuntimeError):
+            logger.exception("edmcoverlay CE: can't start overlay")
+            self._failed(now)
+            return
+        if not started:
+            # there's no point trying again until someone starts it by hand
+            self._give_up()
+            return
+        if not overlay_ready.is_set():
+            if overlay_failed.is_set():
+                logger.error("edmcoverlay CE: server failed to start up")
+                self._failed(now)
+                return
+            # waiting for it here would hold up every other connection too
+            if self._startup_deadline is None:
+                self._startup_deadline = now + STARTUP_TIMEOUT
+            if now < self._startup_deadline:
+                return
+            logger.error("edmcoverlay CE: server failed to start up")
+            self._failed(now)
+            return
+        self._startup_deadline = None
+        try:
+            conn, connecting = self._open_socket()
+        except socket.error as e:
+            self._connect_failed(e.errno, now)
+            return
+        self._conn = conn
+        self._conn_process = overlay_process
+        self._connecting = True
+        self._events = selectors.EVENT_WRITE
+        _selector.register(conn, self._events, self)
+        if not connecting:
+            self._on_connected()
+
+    def _open_socket(self):
+        """Start connecting, returning the socket and whether that's still in progress."""
+        if self._unix_address is not None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.setblocking(False)
+            err = conn.connect_ex(self._unix_address)
+            if err in (0, errno.EINPROGRESS):
+                return conn, err != 0
+            conn.close()
+            logger.debug("edmcoverlay CE: unix socket unavailable, falling back to TCP")
+        conn = socket.socket()
+        try:
+            # messages are already batched, don't let Nagle hold them back
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+            conn.setblocking(False)
+            err = conn.connect_ex((self._server, self._port))
+        except socket.error:
+            conn.close()
+            raise
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            conn.close()
+            raise OSError(err, os.strerror(err))
+        return conn, err != 0
+
+    def _connect_failed(self, err, now):
+        if err == errno.ECONNREFUSED:
+            logger.warning("edmcoverlay CE: conn refused")
+        else:
+            logger.warning("edmcoverlay CE: can't connect: %s", os.strerror(err) if err else "unknown error")
+        self._failed(now)
+
+    def _on_connected(self):
+        self._connecting = False
+        self._backoff = RECONNECT_DELAY
+
+    def _disconnect(self):
+        if self._conn is not None:
+            if not self._connecting:
+                with self._last_sent_lock:
+                    self._generation += 1
+                # but anything still waiting to be written will go over the next one
+                self._carry_over([*self._out_ids, *(_msgid(msg) for _, msg in self._unsent.values())])
+            _selector.unregister(self._conn)
+            self._conn.close()
+            self._conn = None
+        self._connecting = False
+        # whatever made it out of what was being written went with the connection, so start it again
+        self._offset = 0
 
-    def _ensure_connected(self):
-        ensure_overlay()
-        if not self._connected:
+    def _on_event(self, mask):
+        if self._connecting:
+            err = self._conn.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self._connect_failed(err, time.monotonic())
+            else:
+                self._on_connected()
+            return
+        if mask & selectors.EVENT_READ:
+            # the overlay never says anything, so this means it hung up on us
             try:
-                self._conn = socket.socket()
-                self._conn.connect((self._server, self._port))
-            except socket.error as e:
-                if e.errno == errno.ECONNREFUSED:
-                    logger.warning("edmcoverlay CE: conn refused")
+                data = self._conn.recv(4096)
+            except socket.error:
+                data = b""
+            if not data:
+                logger.info("edmcoverlay CE: overlay closed the connection")
+                if self._out or self._unsent:
+                    self._failed(time.monotonic())
                 else:
-                    raise
+                    self._disconnect()
+                return
+        if mask & selectors.EVENT_WRITE and (self._out or self._unsent):
+            self._write()
+
+    def send(self, msg):
+        # encoding happens on the reactor thread, so msg mustn't be modified after this
+        _submit(self, msg)
+
+    def flush(self, timeout=None):
+        waiter = _FlushWaiter()
+        _submit(self, waiter)
+        return waiter.done.wait(timeout) and waiter.ok
+
+    def _pump(self):
+        """Take in everything pending, to be encoded once the socket is ready for it."""
+        items, self._pending = self._pending, []
+        for item in items:
+            if isinstance(item, _FlushWaiter):
+                self._waiters.append([self._sequence, self._dropped, item])
+                self._dropped = False
             else:
-                self._connected = True
+                self._accept(item)
+        # these may have been checked by is_repeat before the last connection
+        # was lost, but none of them have been written yet
+        self._carry_over([_msgid(item) for item in items if not isinstance(item, _FlushWaiter)])
+        self._resolve_waiters()
 
-    def send_raw(self, msg, _retry=True):
-        logger.debug("edmcoverlay CE: send_raw!")
-        self._ensure_connected()
+    def _carry_over(self, msgids):
+        with self._last_sent_lock:
+            for msgid in msgids:
+                last = self._last_sent.get(msgid)
+                if last is not None and last[2] != self._generation:
+                    self._last_sent[msgid] = (*last[:2], self._generation)
+
+    def _accept(self, msg):
+        self._sequence += 1
+        # if we've fallen behind, there's no point drawing anything that's about to
+        # be replaced: only keep the last message for each id, in the order those
+        # last messages were sent
+        key = _msgid(msg)
+        if key is None:
+            key = (self._sequence,)
+        self._unsent[key] = (self._sequence, msg)
+        self._unsent.move_to_end(key)
+        if len(self._unsent) > MAX_UNSENT:
+            if not self._overflowing:
+                logger.warning("edmcoverlay CE: overlay isn't keeping up, dropping the oldest messages")
+                self._overflowing = True
+            _, (sequence, msg) = self._unsent.popitem(last=False)
+            if _msgid(msg) is not None:
+                self.forget(_msgid(msg))
+            self._note_dropped(sequence, sequence)
+
+    def _oldest_unwritten(self):
+        """The sequence number of the oldest message that's yet to be written, if any."""
+        if self._out:
+            return self._out_span[0]
+        if self._unsent:
+            return next(iter(self._unsent.values()))[0]
+        return None
+
+    def _note_dropped(self, oldest, newest):
+        # every flush waiting on any of these needs to fail, and if there
+        # isn't one waiting on the newest yet, the next flush does
+        for waiter in self._waiters:
+            if waiter[0] >= oldest:
+                waiter[1] = True
+        if not self._waiters or self._waiters[-1][0] < newest:
+            self._dropped = True
+
+    def _resolve_waiters(self):
+        oldest = self._oldest_unwritten()
+        while self._waiters and (oldest is None or self._waiters[0][0] < oldest):
+            _, dropped, waiter = self._waiters.popleft()
+            waiter.ok = not dropped
+            waiter.done.set()
+
+    def _encode_unsent(self):
+        # this waits until the socket can take more, so nothing that's replaced
+        # in the meantime is ever encoded, and what's queued stays small
+        encoded = []
+        self._out_ids = []
+        for _, msg in self._unsent.values():
+            try:
+                encoded.append(_encode(msg))
+            except (TypeError, ValueError):
+                logger.exception("edmcoverlay CE: can't encode message: %r", msg)
+                continue
+            self._out_ids.append(_msgid(msg))
+        self._out = _frame(encoded) if encoded else b""
+        self._out_span = (next(iter(self._unsent.values()))[0], next(reversed(self._unsent.values()))[0])
+        self._unsent.clear()
+
+    def _write(self):
+        if not self._out:
+            self._encode_unsent()
+            if not self._out:
+                self._resolve_waiters()
+                return
         try:
-            self._conn.send(json.dumps(msg).encode("utf-8") + b"\n")
-        except socket.error as e:
-            logger.exception("send_raw failed")
-            self._connected = False
-            if _retry:
-                logger.info("retrying...")
-                self.send_raw(msg, _retry=False)
+            self._offset += self._conn.send(memoryview(self._out)[self._offset:])
+        except BlockingIOError:
+            return
+        except socket.error:
+            logger.exception("edmcoverlay CE: send failed")
+            self._failed(time.monotonic())
+            return
+        if self._offset < len(self._out):
+            return
+        self._out = b""
+        self._offset = 0
+        self._out_ids = []
+        self._attempts = 0
+        if not self._unsent:
+            self._overflowing = False
+        self._resolve_waiters()
+
+    def _failed(self, now):
+        """Count a failed attempt, dropping everything queued if there have been too many."""
+        self._disconnect()
+        self._startup_deadline = None
+        self._attempts += 1
+        if self._attempts < RECONNECT_ATTEMPTS:
+            # don't sleep here, that would hold up every other connection too
+            logger.info("edmcoverlay CE: reconnecting in %.1fs", self._backoff)
+            self._retry_at = now + self._backoff
+            self._backoff = min(self._backoff * 2, RECONNECT_MAX_DELAY)
+            return
+        self._give_up()
+
+    def _give_up(self):
+        logger.error("edmcoverlay CE: giving up, dropping %d messages", len(self._out_ids) + len(self._unsent))
+        self._attempts = 0
+        # none of that reached the overlay, so don't treat any of it as showing
+        msgids = self._out_ids + [_msgid(msg) for _, msg in self._unsent.values()]
+        for msgid in msgids:
+            if msgid is not None:
+                self.forget(msgid)
+        newest = next(reversed(self._unsent.values()))[0] if self._unsent else self._out_span[1]
+        self._note_dropped(self._oldest_unwritten(), newest)
+        self._out = b""
+        self._out_ids = []
+        self._unsent.clear()
+        self._resolve_waiters()
+
+    def is_repeat(self, msgid, key, ttl):
+        """Check whether the overlay is already showing exactly this message.
+
+        Repeats are only skipped while more than half of their ttl is left,
+        so that a message sent every tick stays up without flickering.
+        """
+        now = time.monotonic()
+        with self._last_sent_lock:
+            if now >= self._next_prune:
+                self._prune(now)
+            last = self._last_sent.get(msgid)
+            if (
+                last is not None
+                and last[0] == key
+                and last[2] == self._generation
+                # the overlay may have been restarted before the reactor noticed
+                and self._conn_process is overlay_process
+                and (last[1] is None or last[1] - now > ttl / 2)
+            ):
+                return True
+            if ttl == 0:
+                # that's a removal, nothing left to repeat
+                self._last_sent.pop(msgid, None)
             else:
-                logger.error("double fault, not retrying")
-                raise
+                self._last_sent[msgid] = (key, now + ttl if ttl > 0 else None, self._generation)
+            return False
+
+    def forget(self, msgid):
+        """Stop assuming the overlay is showing whatever was last sent for msgid."""
+        with self._last_sent_lock:
+            self._last_sent.pop(msgid, None)
+
+    def _prune(self, now):
+        # must be called with _last_sent_lock held
+        # (without this, every id ever used would be remembered forever)
+        self._last_sent = {
+            msgid: last
+            for msgid, last in self._last_sent.items()
+            if (last[1] is None or last[1] > now) and last[2] == self._generation
+        }
+        self._next_prune = now + PRUNE_INTERVAL
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+_overlay_ids = itertools.count(1)
+
+
+def _get_connection(server, port) -> _Connection:
+    with _connections_lock:
+        connection = _connections.get((server, port))
+        if connection is None:
+            _start_reactor()
+            connection = _connections[server, port] = _Connection(server, port)
+        return connection
+
+
+# all connections are serviced by one reactor thread, however many plugins are
+# sending. other threads hand it work through _reactor_queue and wake it up by
+# writing to a pipe it's watching.
+_reactor_thread = None
+_reactor_lock = threading.Lock()
+_reactor_queue = collections.deque()  # (connection, message or _FlushWaiter)
+_reactor_woken = False
+_selector = None
+_wake_r = _wake_w = None
+
+
+def _start_reactor():
+    # must be called with _connections_lock held
+    global _reactor_thread, _selector, _wake_r, _wake_w
+    if _reactor_thread is not None:
+        return
+    _wake_r, _wake_w = os.pipe()
+    os.set_blocking(_wake_r, False)
+    os.set_blocking(_wake_w, False)
+    _selector = selectors.DefaultSelector()
+    _selector.register(_wake_r, selectors.EVENT_READ)
+    _reactor_thread = threading.Thread(target=_run_reactor, name="edmcoverlay-reactor", daemon=True)
+    _reactor_thread.start()
+
+
+def _submit(connection, item):
+    with _reactor_lock:
+        _reactor_queue.append((connection, item))
+    _wake_reactor()
+
+
+def _wake_reactor():
+    global _reactor_woken
+    with _reactor_lock:
+        if _reactor_woken or _wake_w is None:
+            # it'll pick up anything new along with whatever woke it
+            return
+        _reactor_woken = True
+    os.write(_wake_w, b"x")
+
+
+def _run_reactor():
+    while True:
+        try:
+            _run_reactor_once()
+        except Exception:
+            # if this thread dies, every Overlay silently stops working
+            logger.exception("edmcoverlay CE: reactor error")
+
+
+def _run_reactor_once():
+    global _reactor_woken
+    with _connections_lock:
+        connections = list(_connections.values())
+    timeout = None
+    connect_at = [at for at in (connection._connect_at() for connection in connections) if at is not None]
+    if connect_at:
+        timeout = max(0, min(connect_at) - time.monotonic())
+    for key, mask in _selector.select(timeout):
+        if key.data is None:
+            os.read(_wake_r, 4096)
+            continue
+        # one connection going wrong mustn't stop the others being serviced
+        try:
+            key.data._on_event(mask)
+        except Exception:
+            logger.exception("edmcoverlay CE: error handling connection to %s:%d", key.data._server, key.data._port)
+    # take everything that's piled up since last time, so it goes out in as few writes as possible
+    with _reactor_lock:
+        items = list(_reactor_queue)
+        _reactor_queue.clear()
+        _reactor_woken = False
+    for connection, item in items:
+        connection._pending.append(item)
+    with _connections_lock:
+        connections = list(_connections.values())
+    now = time.monotonic()
+    for connection in connections:
+        try:
+            if connection._pending:
+                connection._pump()
+            connection._service(now)
+        except Exception:
+            logger.exception("edmcoverlay CE: error servicing connection to %s:%d", connection._server, connection._port)
+
+
+class Overlay:
+    def __init__(self, server="127.0.0.1", port=5010) -> None:
+        # every Overlay talking to the same server shares one connection, so
+        # namespace our ids to keep plugins from overwriting each other's messages
+        self._token = f"{next(_overlay_ids)}:"
+        self._server = server
+        self._port = port
+        self._connection = _get_connection(server, port)
+
+    def send_raw(self, msg):
+        logger.debug("edmcoverlay CE: send_raw!")
+        if isinstance(msg, dict) and "id" in msg:
+            msg = {**msg, "id": self._token + str(msg["id"])}
+            # we can't tell what this does to the message on screen, so the
+            # next send_message/send_shape for this id has to go through
+            self._connection.forget(msg["id"])
+        self._connection.send(msg)
+
+    def flush(self, timeout=None):
+        """Wait until everything sent so far has been written to the overlay.
+
+        Returns False if that didn't happen within `timeout` seconds, or if
+        the overlay couldn't be reached and the messages were dropped.
+        """
+        return self._connection.flush(timeout)
 
     def send_message(self, msgid, text, color, x, y, ttl=4, size="normal"):
-        # return self._overlay.send_message(self._token + str(msgid), text, color, x, y, ttl=ttl, size=size)
-        self.send_raw({
+        msgid = self._token + str(msgid)
+        if self._connection.is_repeat(msgid, (text, color, x, y, size, ttl), ttl):
+            return
+        self._connection.send({
             "id": msgid,
             "color": color,
             "text": text,
@@ -124,8 +791,10 @@ class Overlay:
         })
 
     def send_shape(self, shapeid, shape, color, fill, x, y, w, h, ttl):
-        # return self._overlay.send_shape(self._token + shapeid, shape, color, fill, x, y, w, h, ttl)
-        self.send_raw({
+        shapeid = self._token + str(shapeid)
+        if self._connection.is_repeat(shapeid, (shape, color, fill, x, y, w, h, ttl), ttl):
+            return
+        self._connection.send({
             "id": shapeid,
             "shape": shape,
             "color": color,
@@ -1,14 +1,19 @@
 """Totally definitely EDMCOverlay."""
 
+from __future__ import annotations
+
 import logging
 from pathlib import Path
-import tkinter as tk
-from tkinter import ttk
+from typing import TYPE_CHECKING
 
 from config import appname, config
-import myNotebook as nb
 import plug
-from ttkHyperlinkLabel import HyperlinkLabel
+
+# the Tk bits are only needed for the prefs panel, so they're imported there
+if TYPE_CHECKING:
+    import tkinter as tk
+
+    import myNotebook as nb
 
 
 plugin_name = Path(__file__).parent.name
@@ -52,11 +57,18 @@ def plugin_stop():
 
 
 def plugin_prefs(parent: nb.Notebook, cmdr: str, is_beta: bool) -> nb.Frame:
+    import tkinter as tk
+    from tkinter import ttk
+
+    import myNotebook as nb
+    from ttkHyperlinkLabel import HyperlinkLabel
+
     global xpos_var, ypos_var, width_var, height_var
-    xpos_var = tk.IntVar(value=int(config.get("edmcoverlay2_xpos") or 0))
-    ypos_var = tk.IntVar(value=int(config.get("edmcoverlay2_ypos") or 0))
-    width_var = tk.IntVar(value=int(config.get("edmcoverlay2_width") or 1920))
-    height_var = tk.IntVar(value=int(config.get("edmcoverlay2_height") or 1080))
+    xpos, ypos, width, height = edmcoverlay._edmcoverlay.overlay_geometry()
+    xpos_var = tk.IntVar(value=xpos)
+    ypos_var = tk.IntVar(value=ypos)
+    width_var = tk.IntVar(value=width)
+    height_var = tk.IntVar(value=height)
     frame = nb.Frame(parent)
     frame.columnconfigure(0, weight=1)
     PAD_X = 10
@@ -97,21 +109,18 @@ def prefs_changed(cmdr: str, is_beta: bool) -> None:
     ypos = ypos_var.get()
     width = width_var.get()
     height = height_var.get()
+    old_geometry = edmcoverlay._edmcoverlay.overlay_geometry()
     change = False
-    for name, val in [("xpos", xpos), ("ypos", ypos), ("width", width), ("height", height)]:
+    for name, val, old_val in zip(["xpos", "ypos", "width", "height"], [xpos, ypos, width, height], old_geometry):
         try:
             assert int(val) >= 0
         except (ValueError, AssertionError):
             logger.warning("Bad config value for %s: %r", name, val)
         else:
-            try:
-                old_val = int(config.get(f"edmcoverlay2_{name}"))
-            except (TypeError, ValueError):
-                pass
-            else:
-                if val != old_val:
-                    change = True
+            if val != old_val:
+                change = True
             config.set(f"edmcoverlay2_{name}", val)
+    edmcoverlay._edmcoverlay.overlay_geometry.cache_clear()
     if change:
         logger.info("Settings changes detected, restarting overlay")
         if edmcoverlay._edmcoverlay.stop_overlay():
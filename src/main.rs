@@ -7,13 +7,16 @@ use std::collections::HashMap;
 use std::convert::{TryFrom, TryInto};
 use std::ffi::CString;
 use std::mem::MaybeUninit;
+use std::sync::atomic::{AtomicUsize, Ordering};
 
 use eyre::{bail, eyre, WrapErr};
 use lazy_static::lazy_static;
 use regex::Regex;
 use structopt::StructOpt;
-use tokio::io::{AsyncBufReadExt, BufReader};
+use tokio::io::{AsyncBufReadExt, AsyncRead, BufReader};
 use tokio::net::TcpListener;
+#[cfg(target_os = "linux")]
+use tokio::net::UnixListener;
 use tokio::sync::mpsc;
 use tracing::{debug, error, event, info, info_span, instrument, warn, Level};
 use tracing_error::ErrorLayer;
@@ -510,50 +513,98 @@ async fn renderer(opt: Opt, mut rx: mpsc::Receiver<Command>) -> eyre::Result<()>
     }
 }
 
+/// Name of the abstract Unix socket the overlay listens on as well as TCP.
+///
+/// Local clients can skip the whole TCP stack by connecting here instead.
+#[cfg(target_os = "linux")]
+fn unix_socket_name() -> String {
+    format!("\0edmcoverlay-{}", unsafe { libc::getuid() })
+}
+
+// client 0 is the overlay itself (see the version number graphic)
+static NEXT_CLIENT_ID: AtomicUsize = AtomicUsize::new(1);
+
 #[instrument(skip(tx))]
 async fn listener(tx: mpsc::Sender<Command>) -> eyre::Result<()> {
-    let listener = TcpListener::bind("127.0.0.1:5010").await?;
-    let mut client_id: usize = 0;
+    let tcp_listener = TcpListener::bind("127.0.0.1:5010").await?;
+    #[cfg(target_os = "linux")]
+    let unix_listener = match UnixListener::bind(unix_socket_name()) {
+        Ok(listener) => Some(listener),
+        Err(e) => {
+            warn!(error = %e, "could not listen on unix socket, only accepting TCP connections");
+            None
+        }
+    };
     println!("server: ready to accept connections"); // load-bearing println, do not remove!
+    #[cfg(target_os = "linux")]
+    let unix = accept_unix(unix_listener, tx.clone());
+    #[cfg(not(target_os = "linux"))]
+    let unix = std::future::pending::<eyre::Result<()>>();
+    tokio::try_join!(accept_tcp(tcp_listener, tx), unix)?;
+    Ok(())
+}
+
+async fn accept_tcp(listener: TcpListener, tx: mpsc::Sender<Command>) -> eyre::Result<()> {
     loop {
         debug!("waiting for connection");
         let (socket, _) = listener.accept().await?;
-        client_id = client_id.wrapping_add(1);
-        let tx = tx.clone();
-
-        debug!(client_id, "new client");
-        tokio::spawn(
-            async move {
-                debug!("started");
-                let stream = BufReader::new(socket);
-                let mut lines = stream.lines();
-                debug!("waiting for line");
-                while let Some(line) = lines.next_line().await? {
-                    debug!(
-                        client_id,
-                        line = std::convert::AsRef::<str>::as_ref(&line),
-                        "line received"
-                    );
-                    match serde_json::from_str::<Graphic>(&line)
-                        .wrap_err_with(|| eyre!("could not parse line {:?}", line))
-                    {
-                        Ok(graphic) => {
-                            if graphic.drawable.is_none() {
-                                warn!(?line, ?graphic, "invalid drawable");
-                            }
-                            if graphic.drawable.is_some() || graphic.ttl == 0 {
-                                tx.send(Command { client_id, graphic }).await?;
-                            }
+        handle_client(socket, tx.clone());
+    }
+}
+
+#[cfg(target_os = "linux")]
+async fn accept_unix(
+    listener: Option<UnixListener>,
+    tx: mpsc::Sender<Command>,
+) -> eyre::Result<()> {
+    let listener = match listener {
+        Some(listener) => listener,
+        None => return std::future::pending().await,
+    };
+    loop {
+        debug!("waiting for unix connection");
+        let (socket, _) = listener.accept().await?;
+        handle_client(socket, tx.clone());
+    }
+}
+
+fn handle_client<S>(socket: S, tx: mpsc::Sender<Command>)
+where
+    S: AsyncRead + Send + Unpin + 'static,
+{
+    let client_id = NEXT_CLIENT_ID.fetch_add(1, Ordering::Relaxed);
+    debug!(client_id, "new client");
+    tokio::spawn(
+        async move {
+            debug!("started");
+            let stream = BufReader::new(socket);
+            let mut lines = stream.lines();
+            debug!("waiting for line");
+            while let Some(line) = lines.next_line().await? {
+                debug!(
+                    client_id,
+                    line = std::convert::AsRef::<str>::as_ref(&line),
+                    "line received"
+                );
+                match serde_json::from_str::<Graphic>(&line)
+                    .wrap_err_with(|| eyre!("could not parse line {:?}", line))
+                {
+                    Ok(graphic) => {
+                        if graphic.drawable.is_none() {
+                            warn!(?line, ?graphic, "invalid drawable");
                         }
-                        Err(e) => eprintln!("{:#}", eyre!(e)),
-                    };
-                }
-                debug!("client disconnected");
-                Ok::<(), eyre::Report>(())
+                        if graphic.drawable.is_some() || graphic.ttl == 0 {
+                            tx.send(Command { client_id, graphic }).await?;
+                        }
+                    }
+                    Err(e) => eprintln!("{:#}", eyre!(e)),
+                };
             }
-            .instrument(info_span!("handler", client_id)),
-        );
-    }
+            debug!("client disconnected");
+            Ok::<(), eyre::Report>(())
+        }
+        .instrument(info_span!("handler", client_id)),
+    );
 }
 
 #[tokio::main]